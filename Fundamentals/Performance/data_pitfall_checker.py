@@ -1,13 +1,22 @@
-import json
+import asyncio
+import datetime
+import orjson
 import logging
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
 import threading
-from concurrent.futures import ThreadPoolExecutor
 
 # Pitfall Checker Configuration
 PITFALL_CONFIG = {
     'mongo_uri': 'mongodb://localhost:27017/zero0x_db',
+    'mongo_app_name': 'zero0x-pitfall-checker',
+    'mongo_max_pool_size': 50,
+    'mongo_min_pool_size': 5,
+    'mongo_wait_queue_timeout_ms': 2000,
+    'mongo_compressors': 'zstd,zlib',
+    'mongo_zlib_compression_level': 6,
     'max_fields': 100,
+    'type_sample_size': 100,
+    'field_sample_size': 500,
     'time_gap_threshold': 3600,  # seconds
     'mixed_type_threshold': 0.1  # 10% mismatch
 }
@@ -15,71 +24,146 @@ PITFALL_CONFIG = {
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('data_pitfall_checker')
 
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AsyncMongoClient(
+                PITFALL_CONFIG['mongo_uri'],
+                appname=PITFALL_CONFIG['mongo_app_name'],
+                maxPoolSize=PITFALL_CONFIG['mongo_max_pool_size'],
+                minPoolSize=PITFALL_CONFIG['mongo_min_pool_size'],
+                waitQueueTimeoutMS=PITFALL_CONFIG['mongo_wait_queue_timeout_ms'],
+                compressors=PITFALL_CONFIG['mongo_compressors'],
+                zlibCompressionLevel=PITFALL_CONFIG['mongo_zlib_compression_level']
+            )
+    return _client
+
+async def close_client():
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        await client.close()
+
+async def _first_result(coll, pipeline, default=None, **kwargs):
+    cursor = await coll.aggregate(pipeline, **kwargs)
+    docs = await cursor.to_list(length=1)
+    return docs[0] if docs else default
+
+FIELD_KEY_STAGES = [
+    {'$project': {'fields': {'$objectToArray': '$$ROOT'}}},
+    {'$unwind': '$fields'},
+    {'$group': {'_id': None, 'keys': {'$addToSet': '$fields.k'}}}
+]
+
+MIXED_TYPE_STAGES = [
+    {'$project': {'fields': {'$objectToArray': '$$ROOT'}}},
+    {'$unwind': '$fields'},
+    {'$group': {'_id': {'k': '$fields.k', 't': {'$type': '$fields.v'}}, 'n': {'$sum': 1}}}
+]
+
 class DataPitfallChecker:
     def __init__(self):
-        self.client = MongoClient(PITFALL_CONFIG['mongo_uri'])
+        self.client = get_client()
         self.db = self.client['zero0x_db']
-        self.executor = ThreadPoolExecutor(max_workers=4)
-        self.lock = threading.Lock()
 
-    def check_mixed_data(self, dataset_name):
+    async def check_mixed_data(self, dataset_name):
         coll = self.db[dataset_name]
-        sample = coll.aggregate([{'$sample': {'size': 100}}])
-        types = {}
-        for doc in sample:
-            for key, value in doc.items():
-                t = type(value).__name__
-                types.setdefault(key, set()).add(t)
-        issues = [k for k, v in types.items() if len(v) > 1]
+        pipeline = [{'$sample': {'size': PITFALL_CONFIG['type_sample_size']}}] + MIXED_TYPE_STAGES
+        groups = await (await coll.aggregate(pipeline)).to_list(length=None)
+        return self._mixed_type_fields(groups)
+
+    def _mixed_type_fields(self, groups):
+        # key -> [total, count of the most common type]; mismatches are everything else
+        stats = {}
+        for group in groups:
+            key, n = group['_id']['k'], group['n']
+            s = stats.get(key)
+            if s is None:
+                stats[key] = [n, n]
+            else:
+                s[0] += n
+                if n > s[1]:
+                    s[1] = n
+        threshold = PITFALL_CONFIG['mixed_type_threshold']
+        issues = [k for k, (total, dominant) in stats.items() if (total - dominant) / total > threshold]
         if issues:
             logger.warning(f"Mixed types in fields: {issues}")
         return issues
 
-    def check_excessive_backfilling(self, dataset_name):
+    async def ensure_indexes(self, dataset_name):
+        # One-time bootstrap; the checks only read, so they can run without createIndex rights
+        await self.db[dataset_name].create_index([('_time', 1)])
+
+    async def check_excessive_backfilling(self, dataset_name):
         coll = self.db[dataset_name]
+        threshold = PITFALL_CONFIG['time_gap_threshold']
+        # A gap above the threshold implies _time is older than now - threshold, which the index can bound
         pipeline = [
-            {'$project': {'gap': {'$subtract': ['$_sysTime', '$_time']}}},
-            {'$match': {'gap': {'$gt': PITFALL_CONFIG['time_gap_threshold'] * 1000}}}
+            {'$match': {'_time': {'$lt': datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=threshold)}}},
+            {'$match': {'$expr': {'$gt': [{'$subtract': ['$_sysTime', '$_time']}, threshold * 1000]}}},
+            {'$count': 'n'}
         ]
-        gaps = list(coll.aggregate(pipeline))
+        gaps = (await _first_result(coll, pipeline, {'n': 0}))['n']
         if gaps:
-            logger.warning(f"Large time gaps found: {len(gaps)} instances")
-        return len(gaps)
+            logger.warning(f"Large time gaps found: {gaps} instances")
+        return gaps
 
-    def check_large_fields(self, dataset_name):
+    async def check_large_fields(self, dataset_name):
         coll = self.db[dataset_name]
-        pipeline = [
-            {'$project': {'fields': {'$objectToArray': '$$ROOT'}}},
-            {'$unwind': '$fields'},
-            {'$group': {'_id': '$fields.k'}}
-        ]
-        fields = list(coll.aggregate(pipeline))
-        if len(fields) > PITFALL_CONFIG['max_fields']:
-            logger.warning(f"Excessive fields: {len(fields)} > {PITFALL_CONFIG['max_fields']}")
-            return len(fields)
+        pipeline = [{'$sample': {'size': PITFALL_CONFIG['field_sample_size']}}] + FIELD_KEY_STAGES
+        result = await _first_result(coll, pipeline, allowDiskUse=False, batchSize=1)
+        return self._excessive_field_count(result['keys'] if result else [])
+
+    def _excessive_field_count(self, keys):
+        if len(keys) > PITFALL_CONFIG['max_fields']:
+            logger.warning(f"Excessive fields: {len(keys)} > {PITFALL_CONFIG['max_fields']}")
+            return len(keys)
         return 0
 
-    def run_checks(self, dataset_name):
-        futures = [
-            self.executor.submit(self.check_mixed_data, dataset_name),
-            self.executor.submit(self.check_excessive_backfilling, dataset_name),
-            self.executor.submit(self.check_large_fields, dataset_name)
+    async def run_checks(self, dataset_name):
+        coll = self.db[dataset_name]
+        # Type and field checks share one sample; the gap check needs the full collection
+        pipeline = [
+            {'$sample': {'size': PITFALL_CONFIG['field_sample_size']}},
+            {'$facet': {
+                'mixed': [{'$limit': PITFALL_CONFIG['type_sample_size']}] + MIXED_TYPE_STAGES,
+                'fields': FIELD_KEY_STAGES
+            }}
         ]
+        facets, gaps = await asyncio.gather(
+            _first_result(coll, pipeline, allowDiskUse=False, batchSize=1),
+            self.check_excessive_backfilling(dataset_name),
+            return_exceptions=True
+        )
         results = {}
-        for future in futures:
-            try:
-                results.update({future.result().__name__: future.result()})
-            except Exception as e:
-                logger.error(f"Check failed: {e}")
+        if isinstance(facets, Exception):
+            logger.error(f"Sampled checks failed: {facets}")
+        else:
+            results['mixed_types'] = self._mixed_type_fields(facets['mixed'])
+            fields = facets['fields']
+            results['field_count'] = self._excessive_field_count(fields[0]['keys'] if fields else [])
+
+        if isinstance(gaps, Exception):
+            logger.error(f"Backfill check failed: {gaps}")
+        else:
+            results['backfill_gaps'] = gaps
         return results
 
     def shutdown(self):
-        self.executor.shutdown()
-        self.client.close()
         logger.info("Checker shutdown")
 
-if __name__ == "__main__":
+async def main():
     checker = DataPitfallChecker()
-    results = checker.run_checks('trades_dataset')
-    print("Pitfall Check Results:", json.dumps(results, indent=2))
+    await checker.ensure_indexes('trades_dataset')
+    results = await checker.run_checks('trades_dataset')
+    print("Pitfall Check Results:", orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
     checker.shutdown()
+    await close_client()
+
+if __name__ == "__main__":
+    asyncio.run(main())
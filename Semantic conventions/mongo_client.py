@@ -0,0 +1,45 @@
+import threading
+from pymongo import AsyncMongoClient
+
+# Shared Mongo Client Configuration
+MONGO_CONFIG = {
+    'mongo_uri': 'mongodb://localhost:27017/zero0x_db',
+    'mongo_app_name': 'zero0x-semantic-conventions',
+    'mongo_max_pool_size': 50,
+    'mongo_min_pool_size': 5,
+    'mongo_wait_queue_timeout_ms': 2000,
+    'mongo_compressors': 'zstd,zlib',
+    'mongo_zlib_compression_level': 6
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AsyncMongoClient(
+                MONGO_CONFIG['mongo_uri'],
+                appname=MONGO_CONFIG['mongo_app_name'],
+                maxPoolSize=MONGO_CONFIG['mongo_max_pool_size'],
+                minPoolSize=MONGO_CONFIG['mongo_min_pool_size'],
+                waitQueueTimeoutMS=MONGO_CONFIG['mongo_wait_queue_timeout_ms'],
+                compressors=MONGO_CONFIG['mongo_compressors'],
+                zlibCompressionLevel=MONGO_CONFIG['mongo_zlib_compression_level']
+            )
+    return _client
+
+async def close_client():
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        await client.close()
+
+async def ensure_semconv_version_index(collection):
+    # Shared so the migrator and trace handler never create it with conflicting options
+    await collection.create_index(
+        'attributes.semconv_version',
+        partialFilterExpression={'attributes.semconv_version': {'$exists': True}}
+    )
@@ -1,89 +1,167 @@
-import datetime
-import json
-import requests
-import threading
-from pymongo import MongoClient
+import asyncio
+import orjson
+import os
+import time
+import aiohttp
+from pymongo import WriteConcern
+from mongo_client import get_client, close_client, ensure_semconv_version_index
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Semconv Migrator Configuration
 MIGRATOR_CONFIG = {
-    'mongo_uri': 'mongodb://localhost:27017/zero0x_db',
     'otel_schema_url': 'https://opentelemetry.io/schemas',
+    'schema_cache_dir': os.path.expanduser('~/.cache/zero0x'),
+    'schema_cache_ttl': 86400,  # seconds
+    'http_timeout': 5,  # seconds
     'supported_versions': ['1.25', '1.32'],
-    'default_version': '1.32',
-    'max_workers': 4
+    'default_version': '1.32'
 }
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('semconv_migrator')
 
+_schema_cache = {}
+_schema_cache_lock = asyncio.Lock()
+
+_http_session = None
+
+def _get_http_session():
+    # Created lazily because aiohttp sessions must be opened inside the running loop
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=4),
+            timeout=aiohttp.ClientTimeout(total=MIGRATOR_CONFIG['http_timeout'])
+        )
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+
+def _schema_cache_path(cache_key):
+    return os.path.join(MIGRATOR_CONFIG['schema_cache_dir'], f"semconv_{cache_key}.json")
+
+def _read_cached_changes(cache_key):
+    path = _schema_cache_path(cache_key)
+    try:
+        if time.time() - os.path.getmtime(path) > MIGRATOR_CONFIG['schema_cache_ttl']:
+            return None
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+def _write_cached_changes(cache_key, changes):
+    path = _schema_cache_path(cache_key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(changes))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Schema cache write failed: {e}")
+
+def _rename_phases(changes):
+    # One $rename cannot touch a path another rename in it also uses, so chains
+    # ({a: b, b: c}) run target-first, one update_many per pass
+    pending = dict(changes)
+    phases = []
+    while pending:
+        ready = {old_key: new_key for old_key, new_key in pending.items() if new_key not in pending}
+        if not ready:
+            # A cycle would need a parked temporary key, which a re-run after a crash would overwrite
+            raise ValueError(f"Cyclic semconv renames are not supported: {pending}")
+        for old_key in ready:
+            del pending[old_key]
+        phases.append(ready)
+    return phases
+
 class SemconvMigrator:
     def __init__(self):
-        self.client = MongoClient(MIGRATOR_CONFIG['mongo_uri'])
+        self.client = get_client()
         self.db = self.client['zero0x_db']
         self.collection = self.db['traces']
-        self.executor = ThreadPoolExecutor(max_workers=MIGRATOR_CONFIG['max_workers'])
-        self.lock = threading.Lock()
-        self.schema_cache = {}
+        # Backfill migrations are idempotent and re-runnable, so skip journal waits and validation.
+        # Do not reuse this collection handle for live trace writes.
+        self.migration_collection = self.collection.with_options(write_concern=WriteConcern(w=1, j=False))
+        self._indexes_ensured = False
 
-    def _fetch_schema_changes(self, from_version, to_version):
+    async def _ensure_indexes(self):
+        if self._indexes_ensured:
+            return
+        await ensure_semconv_version_index(self.collection)
+        self._indexes_ensured = True
+
+    async def _fetch_schema_changes(self, from_version, to_version):
         cache_key = f"{from_version}_{to_version}"
-        if cache_key in self.schema_cache:
-            return self.schema_cache[cache_key]
+        # Held across the fetch so concurrent migrators wait for one download
+        async with _schema_cache_lock:
+            if cache_key not in _schema_cache:
+                changes = _read_cached_changes(cache_key)
+                if changes is None:
+                    changes = await self._download_schema_changes(cache_key, to_version)
+                _schema_cache[cache_key] = self._compile_migration(changes, to_version)
+            return _schema_cache[cache_key]
+
+    def _compile_migration(self, changes, to_version):
+        # Built once per version pair so the write path never touches the changes map
+        return {'rename_updates': self._build_rename_updates(changes, to_version)}
 
+    def _build_rename_updates(self, changes, to_version):
+        updates = [{"$rename": phase} for phase in _rename_phases(changes)] or [{}]
+        # Only the last pass moves traces off from_version, so earlier passes still match the filter
+        updates[-1]["$set"] = {"attributes.semconv_version": to_version}
+        updates[-1]["$currentDate"] = {"_sysTime": True}
+        return updates
+
+    async def _download_schema_changes(self, cache_key, to_version):
         # Simulate fetching changes
         url = f"{MIGRATOR_CONFIG['otel_schema_url']}/{to_version}/changes.json"
         try:
-            response = requests.get(url)
-            changes = response.json() if response.status_code == 200 else {}
+            async with _get_http_session().get(url) as response:
+                if response.status != 200:
+                    return {}
+                changes = orjson.loads(await response.read())
         except Exception as e:
             logger.error(f"Fetch changes failed: {e}")
-            changes = {
+            return {
                 "attributes.custom.trade_type": "attributes.trade.type",
                 "attributes.custom.chain_id": "attributes.chain.id"
             }
 
-        self.schema_cache[cache_key] = changes
+        _write_cached_changes(cache_key, changes)
         return changes
 
-    def migrate_traces(self, from_version, to_version):
-        changes = self._fetch_schema_changes(from_version, to_version)
-        cursor = self.collection.find({"attributes.semconv_version": from_version})
-        futures = []
-
-        for doc in cursor:
-            futures.append(self.executor.submit(self._migrate_single_trace, doc, changes, to_version))
-
-        migrated = 0
-        for future in as_completed(futures):
-            if future.result():
-                migrated += 1
+    async def migrate_traces(self, from_version, to_version):
+        await self._ensure_indexes()
+        migration = await self._fetch_schema_changes(from_version, to_version)
+        # $rename skips traces that lack a source key, so absent keys never create empty parents
+        for update in migration['rename_updates']:
+            result = await self.migration_collection.update_many(
+                {"attributes.semconv_version": from_version},
+                update,
+                bypass_document_validation=True
+            )
+        # Only the last pass changes the version, so its count is the number migrated
+        migrated = result.modified_count
 
         logger.info(f"Migrated {migrated} traces from {from_version} to {to_version}")
         return migrated
 
-    def _migrate_single_trace(self, doc, changes, to_version):
-        remapped = {k: v for k, v in doc.items()}
-        attributes = remapped.get('attributes', {})
-        for old_key, new_key in changes.items():
-            if old_key in attributes:
-                attributes[new_key] = attributes.pop(old_key)
-
-        remapped['attributes']['semconv_version'] = to_version
-        remapped['_sysTime'] = datetime.datetime.utcnow()
-
-        with self.lock:
-            result = self.collection.update_one({"_id": doc['_id']}, {"$set": remapped})
-            return result.modified_count > 0
-
     def shutdown(self):
-        self.executor.shutdown(wait=True)
-        self.client.close()
         logger.info("Migrator shutdown")
 
-if __name__ == "__main__":
+async def main():
     migrator = SemconvMigrator()
-    count = migrator.migrate_traces('1.25', '1.32')
+    count = await migrator.migrate_traces('1.25', '1.32')
     print(f"Migrated count: {count}")
     migrator.shutdown()
+    await close_http_session()
+    await close_client()
+
+if __name__ == "__main__":
+    asyncio.run(main())
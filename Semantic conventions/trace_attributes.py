@@ -1,16 +1,16 @@
+import asyncio
 import datetime
 import json
-import threading
-from pymongo import MongoClient
+from mongo_client import get_client, close_client, ensure_semconv_version_index
 import logging
 from opentelemetry import trace
 
 # Trace Attributes Configuration
 TRACE_CONFIG = {
-    'mongo_uri': 'mongodb://localhost:27017/zero0x_db',
     'supported_versions': ['1.25', '1.32'],
     'default_version': '1.32',
-    'semconv_schema_url': 'https://opentelemetry.io/schemas/1.32'
+    'semconv_schema_url': 'https://opentelemetry.io/schemas/1.32',
+    'cursor_batch_size': 500
 }
 
 # Logging setup
@@ -19,18 +19,23 @@ logger = logging.getLogger('trace_attributes')
 
 class TraceAttributesHandler:
     def __init__(self):
-        self.client = MongoClient(TRACE_CONFIG['mongo_uri'])
+        self.client = get_client()
         self.db = self.client['zero0x_db']
         self.collection = self.db['traces']
         self.tracer = trace.get_tracer('zero0x.traces')
-        self.lock = threading.Lock()
-        self._ensure_indexes()
+        self._indexes_ensured = False
 
-    def _ensure_indexes(self):
-        self.collection.create_index([('attributes.trade_id', 1), ('_time', -1)], sparse=True)
+    async def _ensure_indexes(self):
+        # Done on first use since __init__ cannot await
+        if self._indexes_ensured:
+            return
+        await self.collection.create_index([('attributes.trade_id', 1), ('_time', -1)], sparse=True)
+        await ensure_semconv_version_index(self.collection)
+        self._indexes_ensured = True
         logger.info("Indexes ensured for trace collection")
 
-    def process_trace(self, trace_data, semconv_version):
+    async def process_trace(self, trace_data, semconv_version):
+        await self._ensure_indexes()
         with self.tracer.start_as_current_span("process_trace") as span:
             if semconv_version not in TRACE_CONFIG['supported_versions']:
                 semconv_version = TRACE_CONFIG['default_version']
@@ -38,31 +43,40 @@ class TraceAttributesHandler:
                 span.set_attribute("version_fallback", True)
 
             trace_data['attributes']['semconv_version'] = semconv_version
-            trace_data['_time'] = datetime.datetime.utcnow()
-            trace_data['_sysTime'] = datetime.datetime.utcnow()
+            now = datetime.datetime.now(datetime.timezone.utc)
+            trace_data['_time'] = now
+            trace_data['_sysTime'] = now
 
-            with self.lock:
-                result = self.collection.insert_one(trace_data)
-                logger.info(f"Trace inserted: {result.inserted_id}")
+            result = await self.collection.insert_one(trace_data)
+            logger.info(f"Trace inserted: {result.inserted_id}")
 
             span.set_attribute("trace_id", str(result.inserted_id))
             span.set_attribute("semconv_version", semconv_version)
 
         return result.inserted_id
 
-    def retrieve_traces(self, query, version):
-        with self.tracer.start_as_current_span("retrieve_traces") as span:
-            cursor = self.collection.find(query)
-            traces = list(cursor)
-            logger.info(f"Retrieved {len(traces)} traces for version {version}")
-            span.set_attribute("result_count", len(traces))
-            return traces
+    async def retrieve_traces(self, query, version, projection=None, limit=None):
+        await self._ensure_indexes()
+        # Not the current span: a generator suspends between yields and would leak it to the caller
+        with self.tracer.start_span("retrieve_traces") as span:
+            cursor = self.collection.find(query, projection=projection, batch_size=TRACE_CONFIG['cursor_batch_size'])
+            if limit:
+                cursor = cursor.limit(limit)
+            count = 0
+            async for doc in cursor:
+                count += 1
+                yield doc
+            logger.info(f"Retrieved {count} traces for version {version}")
+            span.set_attribute("result_count", count)
+
+    async def count_traces(self, query):
+        await self._ensure_indexes()
+        return await self.collection.count_documents(query)
 
     def shutdown(self):
-        self.client.close()
         logger.info("Trace handler shutdown")
 
-if __name__ == "__main__":
+async def main():
     handler = TraceAttributesHandler()
     trace_data = {
         "attributes": {
@@ -70,7 +84,11 @@ if __name__ == "__main__":
             "chain_id": "solana"
         }
     }
-    trace_id = handler.process_trace(trace_data, '1.32')
-    results = handler.retrieve_traces({"attributes.semconv_version": '1.32'}, '1.32')
+    trace_id = await handler.process_trace(trace_data, '1.32')
+    results = [doc async for doc in handler.retrieve_traces({"attributes.semconv_version": '1.32'}, '1.32')]
     print(f"Processed trace ID: {trace_id}, Retrieved: {len(results)}")
     handler.shutdown()
+    await close_client()
+
+if __name__ == "__main__":
+    asyncio.run(main())